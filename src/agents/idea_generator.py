@@ -3,11 +3,15 @@ IdeaGeneratorAgent: A specialized agent for generating content ideas related to
 """
 
 import os
+import re
+import json
 import pandas as pd
 from datetime import datetime
 from typing import List, Dict
-from crewai import Agent
-from pathlib import Path
+
+from config.settings import IDEAS_FILE, USED_IDEAS_FILE, LEGACY_IDEAS_FILE
+
+IDEA_KEYS = {'title', 'key_points', 'target_audience', 'tone'}
 
 class IdeaGeneratorAgent:
     def __init__(self):
@@ -18,12 +22,8 @@ class IdeaGeneratorAgent:
         particularly Move Language and Movement Labs. You understand the technical aspects while being 
         able to communicate them effectively to different audience segments."""
         
-        self.ideas_file = "data/content_ideas.xlsx"
-        self._ensure_data_dir()
-        
-    def _ensure_data_dir(self):
-        """Ensure the data directory exists."""
-        Path("data").mkdir(exist_ok=True)
+        self.ideas_file = IDEAS_FILE
+        self.used_ids_file = USED_IDEAS_FILE
         
     def process_trends(self, recent_tweets: List[Dict]) -> List[Dict]:
         """
@@ -35,6 +35,8 @@ class IdeaGeneratorAgent:
         Returns:
             List of new content ideas
         """
+        from crewai import Agent
+        
         # Create agent with LLM
         agent = Agent(
             name=self.name,
@@ -55,12 +57,13 @@ class IdeaGeneratorAgent:
             
             Generate 5 new content ideas that would resonate with the community.
             Each idea should include:
-            - Title
-            - Key points to cover
-            - Target audience
-            - Suggested tone
+            - title: Title
+            - key_points: Key points to cover
+            - target_audience: Target audience
+            - tone: Suggested tone
             
-            Format as JSON list."""
+            Respond with only a JSON list of objects using exactly these keys,
+            without markdown formatting or any other text."""
         )
         
         # Parse response into structured ideas
@@ -71,28 +74,72 @@ class IdeaGeneratorAgent:
         
         return ideas
         
-    def load_existing_ideas(self) -> pd.DataFrame:
-        """Load existing content ideas from Excel file."""
+    def _write_ideas_table(self, ideas_df: pd.DataFrame):
+        """Write content ideas to the Parquet file, replacing it atomically."""
+        tmp_file = f"{self.ideas_file}.tmp"
+        ideas_df.to_parquet(tmp_file, engine="pyarrow", compression="zstd", index=False)
+        os.replace(tmp_file, self.ideas_file)
+        
+    def _import_legacy_ideas(self) -> pd.DataFrame:
+        """Import ideas and used flags from the Excel file used before Parquet."""
+        legacy_df = pd.read_excel(LEGACY_IDEAS_FILE)
+        legacy_df['id'] = range(len(legacy_df))
+        for key in IDEA_KEYS:
+            legacy_df[key] = legacy_df[key].fillna("").astype(str)
+        legacy_df['created_at'] = pd.to_datetime(legacy_df['created_at'])
+        
+        # Record used ideas before writing the table, so an interrupted import reruns cleanly
+        used = legacy_df['used'].fillna(False).astype(bool)
+        with open(self.used_ids_file, 'w') as f:
+            f.writelines(f"{idea_id}\n" for idea_id in legacy_df.loc[used, 'id'])
+            
+        ideas_df = legacy_df.drop(columns=['used'])
+        self._write_ideas_table(ideas_df)
+        print(f"Imported {len(ideas_df)} ideas from {LEGACY_IDEAS_FILE}")
+        return ideas_df
+        
+    def _load_ideas_table(self) -> pd.DataFrame:
+        """Load stored content ideas from Parquet file."""
         try:
-            return pd.read_excel(self.ideas_file)
+            return pd.read_parquet(self.ideas_file, engine="pyarrow")
         except FileNotFoundError:
+            if os.path.exists(LEGACY_IDEAS_FILE):
+                return self._import_legacy_ideas()
             return pd.DataFrame(columns=[
-                'title', 'key_points', 'target_audience', 
-                'tone', 'created_at', 'used'
+                'id', 'title', 'key_points', 'target_audience',
+                'tone', 'created_at'
             ])
             
+    def _load_used_ids(self) -> set:
+        """Load IDs of ideas that have already been used."""
+        try:
+            with open(self.used_ids_file, 'r') as f:
+                return {int(line) for line in f if line.strip()}
+        except FileNotFoundError:
+            return set()
+            
+    def load_existing_ideas(self) -> pd.DataFrame:
+        """Load existing content ideas along with their used flag."""
+        ideas_df = self._load_ideas_table()
+        ideas_df['used'] = ideas_df['id'].isin(self._load_used_ids())
+        return ideas_df
+            
     def save_ideas(self, new_ideas: List[Dict]):
-        """Save new ideas to Excel file."""
-        existing_df = self.load_existing_ideas()
+        """Save new ideas to Parquet file."""
+        if not new_ideas:
+            return
+            
+        existing_df = self._load_ideas_table()
         
-        # Convert new ideas to DataFrame
+        # Convert new ideas to DataFrame with sequential IDs
+        next_id = int(existing_df['id'].max()) + 1 if len(existing_df) else 0
         new_df = pd.DataFrame(new_ideas)
+        new_df['id'] = range(next_id, next_id + len(new_df))
         new_df['created_at'] = datetime.now()
-        new_df['used'] = False
         
-        # Append new ideas
-        updated_df = pd.concat([existing_df, new_df], ignore_index=True)
-        updated_df.to_excel(self.ideas_file, index=False)
+        # Append new ideas and replace the file atomically
+        updated_df = pd.concat([existing_df, new_df], ignore_index=True) if len(existing_df) else new_df
+        self._write_ideas_table(updated_df)
         
     def get_unused_idea(self) -> Dict:
         """Get a random unused idea and mark it as used."""
@@ -106,19 +153,71 @@ class IdeaGeneratorAgent:
         # Select random unused idea
         idea = unused.sample(1).iloc[0]
         
-        # Mark as used
-        ideas_df.loc[idea.name, 'used'] = True
-        ideas_df.to_excel(self.ideas_file, index=False)
+        # Mark as used by appending its ID instead of rewriting the ideas file
+        with open(self.used_ids_file, 'a') as f:
+            f.write(f"{int(idea['id'])}\n")
         
         return idea.to_dict()
         
+    @staticmethod
+    def _load_json(text: str):
+        """Load JSON text, returning None if it is invalid."""
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return None
+            
+    @staticmethod
+    def _normalize_keys(item: Dict) -> Dict:
+        """Normalize idea keys such as "Key Points" to snake case."""
+        return {str(key).strip().lower().replace(' ', '_'): value for key, value in item.items()}
+        
     def _parse_ideas(self, llm_response: str) -> List[Dict]:
         """Parse LLM response into structured ideas."""
-        # TODO: Implement proper JSON parsing
-        # For now return dummy structure
-        return [{
-            'title': 'Understanding Move Language Smart Contracts',
-            'key_points': 'Safety, Performance, Developer Experience',
-            'target_audience': 'Web3 Developers',
-            'tone': 'Technical but accessible'
-        }] 
\ No newline at end of file
+        text = str(llm_response)
+        
+        # Strip markdown code fences
+        cleaned = re.sub(r'^```(?:json)?\s*\n?|\n?```\s*$', '', text.strip(), flags=re.M)
+        
+        # Try the whole response, then the first JSON array or object in it
+        parsed = self._load_json(cleaned)
+        for pattern in (r'\[.*\]', r'\{.*\}'):
+            if parsed is not None:
+                break
+            match = re.search(pattern, cleaned, re.S)
+            if match:
+                parsed = self._load_json(match.group(0))
+                
+        if parsed is None:
+            print(f"Could not parse ideas from LLM response:\n{text}")
+            raise ValueError("LLM response does not contain valid JSON")
+            
+        # Accept a bare list, a single idea, or a wrapper object such as {"ideas": [...]}
+        if isinstance(parsed, dict):
+            if IDEA_KEYS.issubset(self._normalize_keys(parsed)):
+                parsed = [parsed]
+            else:
+                lists = [value for value in parsed.values() if isinstance(value, list)]
+                parsed = lists[0] if lists else [parsed]
+        if not isinstance(parsed, list):
+            print(f"Unexpected JSON in LLM response:\n{text}")
+            raise ValueError("LLM response JSON is not a list or object of ideas")
+            
+        ideas = []
+        for item in parsed:
+            if not isinstance(item, dict):
+                continue
+            item = self._normalize_keys(item)
+            if not IDEA_KEYS.issubset(item):
+                continue
+            idea = {}
+            for key in IDEA_KEYS:
+                value = item[key]
+                idea[key] = ", ".join(map(str, value)) if isinstance(value, list) else str(value)
+            ideas.append(idea)
+            
+        if not ideas:
+            print(f"No valid ideas found in LLM response:\n{text}")
+            raise ValueError(f"LLM response has no ideas with keys {sorted(IDEA_KEYS)}")
+            
+        return ideas
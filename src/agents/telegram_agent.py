@@ -3,29 +3,46 @@ TelegramAgent: A specialized agent for handling Telegram interactions with RAG c
 """
 
 import os
-from typing import List, Dict
-from pathlib import Path
+from functools import cached_property
+from typing import AsyncIterator, List, Dict, Optional, TYPE_CHECKING
 import openai
 import asyncio
+import contextvars
 from collections import defaultdict
-import json
-from datetime import datetime, timedelta
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.vectorstores import LanceDB
-from langchain.tools import Tool
-from crewai import Agent, Task, Crew
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+import time
+from datetime import datetime
+import numpy as np
 import lancedb
 
+from utils.embedding_cache import get_cached_embedder
 from config.settings import (
     VECTOR_DB_PATH,
     CHAT_CONTEXT_EXPIRY_HOURS,
     MAX_CHAT_HISTORY,
     IMMEDIATE_CONTEXT_SIZE,
     MODEL_NAME,
-    MAX_DOCS_PER_QUERY
+    MAX_DOCS_PER_QUERY,
+    RESPONSE_TEMPERATURE,
+    FAST_PATH_CONFIDENCE_THRESHOLD,
+    CHAT_CONTEXT_FLUSH_INTERVAL,
+    QA_CACHE_SIMILARITY_THRESHOLD,
+    QA_CACHE_TTL_DAYS,
+    QA_CACHE_SWEEP_INTERVAL,
+    QA_CACHE_MAX_ENTRIES,
+    RAG_POOL_WORKERS,
+    CHAT_CONTEXT_FILE
 )
 
-CHAT_CONTEXT_FILE = "data/chat_contexts.json"
+if TYPE_CHECKING:
+    from langchain.tools import Tool
+    from crewai import Agent
+
+# (question, embedding) of the question a research crew is currently answering
+_current_query = contextvars.ContextVar("current_query", default=None)
+
+NO_DOCS_FOUND = "No relevant documentation found."
 
 class TelegramAgent:
     def __init__(self):
@@ -36,64 +53,133 @@ class TelegramAgent:
         Your role is to help users understand technical concepts and solve problems by providing
         accurate information from the official documentation."""
         
-        self.embeddings = OpenAIEmbeddings()
+        # Clients, the vector store and chat contexts are created on first use
+        self._pool = ThreadPoolExecutor(max_workers=RAG_POOL_WORKERS, thread_name_prefix="rag")
+        self._table = None
+        self._qa_cache = None
+        self._last_qa_cache_sweep = 0.0
         self.user_locks = defaultdict(asyncio.Lock)
-        self.chat_contexts = self._load_chat_contexts()
+        self._contexts_dirty = False
+        self._flush_task = None
+        
+    @cached_property
+    def embeddings(self):
+        """Shared cached embedder."""
+        return get_cached_embedder()
+        
+    @cached_property
+    def _aoai(self) -> openai.AsyncOpenAI:
+        """Async OpenAI client for the fast answer path."""
+        return openai.AsyncOpenAI()
+        
+    @cached_property
+    def _db(self):
+        """Vector database connection."""
+        return lancedb.connect(VECTOR_DB_PATH)
+        
+    @cached_property
+    def _search_tool(self) -> "Tool":
+        """Document search tool shared by all crew runs."""
+        return self.create_search_tool()
+        
+    @cached_property
+    def chat_contexts(self) -> Dict:
+        """Chat contexts for all users."""
+        return self._load_chat_contexts()
         
     def _load_chat_contexts(self) -> Dict:
         """Load chat contexts from file."""
         try:
             if os.path.exists(CHAT_CONTEXT_FILE):
-                with open(CHAT_CONTEXT_FILE, 'r') as f:
-                    return json.load(f)
-        except (json.JSONDecodeError, OSError):
+                with open(CHAT_CONTEXT_FILE, 'rb') as f:
+                    contexts = orjson.loads(f.read())
+                # Convert ISO timestamps saved by older versions to Unix time
+                for context in contexts.values():
+                    if isinstance(context['last_interaction'], str):
+                        context['last_interaction'] = datetime.fromisoformat(context['last_interaction']).timestamp()
+                return contexts
+        except (orjson.JSONDecodeError, OSError, KeyError, ValueError):
             # If file is corrupted or can't be read, start fresh
             if os.path.exists(CHAT_CONTEXT_FILE):
                 os.remove(CHAT_CONTEXT_FILE)
         return {}
         
-    def _save_chat_contexts(self):
+    def _save_chat_contexts(self, data: bytes = None):
         """Save chat contexts to file."""
-        with open(CHAT_CONTEXT_FILE, 'w') as f:
-            json.dump(self.chat_contexts, f)
+        if data is None:
+            data = orjson.dumps(self.chat_contexts)
+        # Write to a temporary file first so a crash never leaves a truncated file
+        tmp_file = f"{CHAT_CONTEXT_FILE}.tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file, CHAT_CONTEXT_FILE)
+        
+    async def flush_chat_contexts(self):
+        """Save chat contexts to file if they changed since the last save."""
+        if not self._contexts_dirty:
+            return
+        self._contexts_dirty = False
+        # Serialize on the event loop for a consistent snapshot, write in a thread
+        data = orjson.dumps(self.chat_contexts)
+        try:
+            await asyncio.get_event_loop().run_in_executor(
+                None,
+                self._save_chat_contexts,
+                data
+            )
+        except Exception:
+            # Keep the changes pending so the next flush retries them
+            self._contexts_dirty = True
+            raise
+        
+    async def _flush_loop(self):
+        """Periodically expire old chat contexts and persist changes."""
+        while True:
+            await asyncio.sleep(CHAT_CONTEXT_FLUSH_INTERVAL)
+            try:
+                self._clean_expired_contexts()
+                await self.flush_chat_contexts()
+                if time.time() - self._last_qa_cache_sweep > QA_CACHE_SWEEP_INTERVAL:
+                    self._last_qa_cache_sweep = time.time()
+                    await asyncio.get_event_loop().run_in_executor(None, self._expire_qa_cache)
+            except Exception as e:
+                print(f"Error saving chat contexts: {e}")
             
     def _clean_expired_contexts(self):
         """Remove expired chat contexts."""
-        current_time = datetime.now()
-        expired_users = []
-        
-        for user_id, context in self.chat_contexts.items():
-            last_interaction = datetime.fromisoformat(context['last_interaction'])
-            if current_time - last_interaction > timedelta(hours=CHAT_CONTEXT_EXPIRY_HOURS):
-                expired_users.append(user_id)
+        cutoff = time.time() - CHAT_CONTEXT_EXPIRY_HOURS * 3600
+        expired_users = [
+            user_id for user_id, context in self.chat_contexts.items()
+            if context['last_interaction'] < cutoff
+        ]
                 
         for user_id in expired_users:
             del self.chat_contexts[user_id]
             
         if expired_users:
-            self._save_chat_contexts()
+            self._contexts_dirty = True
             
     def _update_chat_context(self, user_id: str, message: str, response: str):
         """Update chat context for a user."""
         if user_id not in self.chat_contexts:
             self.chat_contexts[user_id] = {
                 'messages': [],
-                'last_interaction': datetime.now().isoformat()
+                'last_interaction': time.time()
             }
             
         context = self.chat_contexts[user_id]
         context['messages'].append({
             'user': message,
             'bot': response,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': time.time()
         })
         
         # Keep only last N messages for context
         if len(context['messages']) > MAX_CHAT_HISTORY:
             context['messages'] = context['messages'][-MAX_CHAT_HISTORY:]
             
-        context['last_interaction'] = datetime.now().isoformat()
-        self._save_chat_contexts()
+        context['last_interaction'] = time.time()
+        self._contexts_dirty = True
             
     def _get_chat_history(self, user_id: str) -> str:
         """Get formatted chat history for a user."""
@@ -110,30 +196,101 @@ class TelegramAgent:
             
         return "\n".join(history)
         
-    def create_search_tool(self) -> Tool:
+    def _get_table(self):
+        """Get the documents table, opening it on first use."""
+        # The table may not exist yet when the agent is created, so open lazily
+        if self._table is None:
+            self._table = self._db.open_table("documents")
+        return self._table
+        
+    def _get_qa_cache(self):
+        """Get the answered-questions cache table, or None if it does not exist yet."""
+        if self._qa_cache is None and "qa_cache" in self._db.table_names():
+            self._qa_cache = self._db.open_table("qa_cache")
+        return self._qa_cache
+        
+    def _lookup_cached_answer(self, query_embedding: List[float]) -> Optional[str]:
+        """Return a previous answer to a near-identical question, if any."""
+        table = self._get_qa_cache()
+        if table is None:
+            return None
+            
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        hits = table.search(query_embedding).limit(1).to_list()
+        if not hits or hits[0]['ts'] < time.time() - QA_CACHE_TTL_DAYS * 86400:
+            return None
+            
+        cached_embedding = np.asarray(hits[0]['vector'], dtype=np.float32)
+        similarity = float(np.dot(cached_embedding, query_embedding) / (
+            np.linalg.norm(cached_embedding) * np.linalg.norm(query_embedding)
+        ))
+        if similarity < QA_CACHE_SIMILARITY_THRESHOLD:
+            return None
+        return hits[0]['answer']
+        
+    def _cache_answer(self, query_embedding: List[float], question: str, answer: str):
+        """Store an answer in the answered-questions cache."""
+        row = {
+            "vector": query_embedding,
+            "question": question,
+            "answer": answer,
+            "ts": time.time()
+        }
+        table = self._get_qa_cache()
+        if table is not None:
+            table.add([row])
+            return
+        try:
+            self._qa_cache = self._db.create_table("qa_cache", data=[row])
+        except Exception:
+            # Another request created the table first
+            self._get_qa_cache().add([row])
+            
+    def _expire_qa_cache(self):
+        """Delete expired and excess cached answers, then compact the table."""
+        table = self._get_qa_cache()
+        if table is None:
+            return
+            
+        table.delete(f"ts < {time.time() - QA_CACHE_TTL_DAYS * 86400}")
+        
+        row_count = table.count_rows()
+        excess = row_count - QA_CACHE_MAX_ENTRIES
+        if excess > 0:
+            timestamps = table.search().select(["ts"]).limit(row_count).to_arrow().column("ts").to_numpy()
+            cutoff = np.partition(timestamps, excess - 1)[excess - 1]
+            table.delete(f"ts <= {cutoff}")
+            
+        # Each cached answer is its own fragment; compact them and drop old versions
+        table.optimize()
+            
+    def _search_documents(self, query_embedding: List[float]) -> str:
+        """Search the vector store and format the matching documents."""
+        # Search vector store
+        results = self._get_table().search(query_embedding).select(["text", "file"]).limit(MAX_DOCS_PER_QUERY).to_arrow()
+        
+        if len(results) == 0:
+            return NO_DOCS_FOUND
+            
+        # Format results, converting one column at a time
+        texts = results.column("text").to_pylist()
+        files = results.column("file").to_pylist()
+        return "\n\n".join(f"From {file}:\n{text}" for file, text in zip(files, texts))
+        
+    def create_search_tool(self) -> "Tool":
         """Create document search tool."""
+        from langchain.tools import Tool
+        
         def search_docs(query: str) -> str:
             """Search documentation for relevant information."""
             try:
-                db = lancedb.connect(VECTOR_DB_PATH)
-                table = db.open_table("documents")
-                
-                # Convert query to embedding
-                query_embedding = self.embeddings.embed_query(query)
-                
-                # Search vector store
-                results = table.search(query_embedding).select(["text", "metadata"]).limit(MAX_DOCS_PER_QUERY).to_arrow()
-                
-                if len(results) == 0:
-                    return "No relevant documentation found."
-                    
-                # Format results
-                response = []
-                for row in results.to_pylist():
-                    metadata = json.loads(row['metadata'])
-                    response.append(f"From {metadata['file']}:\n{row['text']}")
-                    
-                return "\n\n".join(response)
+                # Reuse the question's embedding when the agent searches for it verbatim
+                current_query = _current_query.get()
+                if current_query is not None and query.strip() == current_query[0]:
+                    query_embedding = current_query[1]
+                else:
+                    query_embedding = self.embeddings.embed_query(query)
+                return self._search_documents(query_embedding)
             except Exception as e:
                 print(f"Error searching documents: {e}")
                 return "Error searching documentation. Please try again."
@@ -144,69 +301,209 @@ class TelegramAgent:
             description="Search Movement Labs documentation for relevant information"
         )
         
-    def create_research_agent(self) -> Agent:
+    def create_research_agent(self) -> "Agent":
         """Create documentation research agent."""
+        from crewai import Agent
+        
         return Agent(
             role="Movement Labs Documentation Expert",
             goal="Find and provide accurate information from Movement Labs documentation",
             backstory="""You are an expert in Movement Labs' documentation, with deep knowledge
             of Move Language, Movement blockchain, and related technologies. Your role is to search
             and analyze documentation to provide accurate and helpful information.""",
-            tools=[self.create_search_tool()],
+            tools=[self._search_tool],
             allow_delegation=False,
             verbose=True
         )
         
+    def _answer_messages(self, question: str, chat_history: str, docs: str,
+                         instructions: str = "") -> List[Dict]:
+        """Build the chat messages for answering a question from retrieved docs."""
+        return [
+            {"role": "system", "content": self.backstory},
+            {"role": "user", "content": f"""Answer the question using the documentation below.
+            
+            Documentation:
+            {docs}
+            
+            Chat History:
+            {chat_history}
+            
+            Current Question:
+            {question}
+            
+            Provide a clear and accurate answer based on the documentation.
+            If information is missing or unclear, say so explicitly.
+            Maintain conversation context and reference previous discussion if relevant.
+            {instructions}"""}
+        ]
+        
+    async def answer_question_fast(self, question: str, chat_history: str,
+                                   query_embedding: List[float] = None) -> Optional[str]:
+        """Answer a question without CrewAI; returns None when confidence is too low."""
+        try:
+            if query_embedding is None:
+                query_embedding = await self.embeddings.aembed_query(question)
+            docs = await asyncio.to_thread(self._search_documents, query_embedding)
+            completion = await self._aoai.chat.completions.create(
+                model=MODEL_NAME,
+                temperature=RESPONSE_TEMPERATURE,
+                response_format={"type": "json_object"},
+                messages=self._answer_messages(
+                    question,
+                    chat_history,
+                    docs,
+                    """Respond as a JSON object with the keys "answer" (string) and
+                    "confidence" (number from 0 to 1, how well the documentation supports the answer)."""
+                )
+            )
+            result = orjson.loads(completion.choices[0].message.content)
+            if float(result.get('confidence', 0)) < FAST_PATH_CONFIDENCE_THRESHOLD:
+                return None
+            return result.get('answer') or None
+        except Exception as e:
+            print(f"Error in fast answer path: {e}")
+            return None
+            
+    async def _answer_with_crew(self, question: str, chat_history: str,
+                                query_embedding: List[float] = None) -> str:
+        """Answer a question with the CrewAI research agent."""
+        from crewai import Task, Crew
+        
+        # Agents keep per-run executor state, so each concurrent run gets its own
+        research_agent = self.create_research_agent()
+        
+        # Create research task
+        task = Task(
+            description=f"""Research and answer the following question:
+            
+            Chat History:
+            {chat_history}
+            
+            Current Question:
+            {question}
+            
+            Use the search tool to find relevant documentation.
+            Provide a clear and accurate answer based on the documentation.
+            If information is missing or unclear, say so explicitly.
+            Maintain conversation context and reference previous discussion if relevant.""",
+            expected_output="A clear and accurate answer to the user's question, based on Movement Labs documentation.",
+            agent=research_agent
+        )
+        
+        # Create crew with single agent
+        crew = Crew(
+            agents=[research_agent],
+            tasks=[task],
+            verbose=True
+        )
+        
+        # Execute task in the dedicated thread pool, passing the question's embedding along
+        context = contextvars.copy_context()
+        if query_embedding is not None:
+            context.run(_current_query.set, (question, query_embedding))
+        response = await asyncio.get_running_loop().run_in_executor(
+            self._pool,
+            context.run,
+            crew.kickoff
+        )
+        
+        # Convert CrewOutput to string
+        return str(response)
+        
     async def answer_question(self, question: str, user_id: str) -> str:
         """Answer a question using RAG asynchronously with chat context."""
         async with self.user_locks[user_id]:
+            # Embed the question once for the answer cache and the fast path
+            query_embedding = await self.embeddings.aembed_query(question)
+            
             # Get chat history
             chat_history = self._get_chat_history(user_id)
             
-            # Create research task
-            task = Task(
-                description=f"""Research and answer the following question:
-                
-                Chat History:
-                {chat_history}
-                
-                Current Question:
-                {question}
-                
-                Use the search tool to find relevant documentation.
-                Provide a clear and accurate answer based on the documentation.
-                If information is missing or unclear, say so explicitly.
-                Maintain conversation context and reference previous discussion if relevant.""",
-                expected_output="A clear and accurate answer to the user's question, based on Movement Labs documentation.",
-                agent=self.create_research_agent()
-            )
-            
-            # Create crew with single agent
-            crew = Crew(
-                agents=[self.create_research_agent()],
-                tasks=[task],
-                verbose=True
-            )
-            
-            # Execute task in thread pool
-            response = await asyncio.get_event_loop().run_in_executor(
-                None,
-                crew.kickoff
-            )
-            
-            # Convert CrewOutput to string
-            response_text = str(response)
+            # Answers depend on the conversation, so only standalone questions share them
+            response_text = None
+            if not chat_history:
+                try:
+                    response_text = await asyncio.to_thread(self._lookup_cached_answer, query_embedding)
+                except Exception as e:
+                    print(f"Error reading answer cache: {e}")
+                    
+            if response_text is None:
+                # Try the single-pass answer first, fall back to the research crew
+                response_text = await self.answer_question_fast(question, chat_history, query_embedding)
+                if response_text is None:
+                    response_text = await self._answer_with_crew(question, chat_history, query_embedding)
+                elif not chat_history:
+                    # Only confident single-pass answers are cached
+                    try:
+                        await asyncio.to_thread(self._cache_answer, query_embedding, question, response_text)
+                    except Exception as e:
+                        print(f"Error writing answer cache: {e}")
             
             # Update chat context
             self._update_chat_context(user_id, question, response_text)
             
             return response_text
         
+    async def stream_answer(self, question: str, user_id: str) -> AsyncIterator[str]:
+        """Answer a question with a single streamed completion, yielding text as it arrives."""
+        async with self.user_locks[user_id]:
+            query_embedding = await self.embeddings.aembed_query(question)
+            chat_history = self._get_chat_history(user_id)
+            
+            # Answers depend on the conversation, so only standalone questions share them
+            response_text = None
+            if not chat_history:
+                try:
+                    response_text = await asyncio.to_thread(self._lookup_cached_answer, query_embedding)
+                except Exception as e:
+                    print(f"Error reading answer cache: {e}")
+                    
+            if response_text is not None:
+                yield response_text
+            else:
+                docs = await asyncio.to_thread(self._search_documents, query_embedding)
+                stream = await self._aoai.chat.completions.create(
+                    model=MODEL_NAME,
+                    temperature=RESPONSE_TEMPERATURE,
+                    messages=self._answer_messages(question, chat_history, docs),
+                    stream=True
+                )
+                
+                parts = []
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+                response_text = "".join(parts)
+                
+                # Don't cache answers written without any documentation
+                if not chat_history and docs != NO_DOCS_FOUND:
+                    try:
+                        await asyncio.to_thread(self._cache_answer, query_embedding, question, response_text)
+                    except Exception as e:
+                        print(f"Error writing answer cache: {e}")
+                    
+            # Update chat context
+            self._update_chat_context(user_id, question, response_text)
+            
+    def _ensure_flush_task(self):
+        """Expire and persist chat contexts in the background."""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+            
     async def process_message(self, message: str, user_id: str) -> str:
         """Process an incoming Telegram message asynchronously."""
-        # Clean expired contexts periodically
-        self._clean_expired_contexts()
+        self._ensure_flush_task()
         
         # Extract question and generate response
         question = message.strip()
-        return await self.answer_question(question, user_id) 
\ No newline at end of file
+        return await self.answer_question(question, user_id)
+        
+    def stream_message(self, message: str, user_id: str) -> AsyncIterator[str]:
+        """Process an incoming Telegram message, streaming the response as it is generated."""
+        self._ensure_flush_task()
+        
+        # Extract question and stream response
+        question = message.strip()
+        return self.stream_answer(question, user_id) 
\ No newline at end of file
@@ -18,6 +18,7 @@ TWITTER_ACCESS_TOKEN_SECRET = os.getenv("TWITTER_ACCESS_TOKEN_SECRET")
 TWITTER_BEARER_TOKEN = os.getenv("TWITTER_BEARER_TOKEN")
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_GROUP_ID = os.getenv("TELEGRAM_GROUP_ID")
+GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")  # Optional, raises GitHub API rate limits
 
 # Twitter Account IDs
 MOVEMENT_TWITTER_ID = os.getenv("MOVEMENT_TWITTER_ID")
@@ -60,16 +61,37 @@ MAX_DOCS_PER_QUERY = 3
 MODEL_NAME = "gpt-4-turbo-preview"  # Model for CrewAI agents
 
 # Vector Database
+EMBEDDING_MODEL = "text-embedding-ada-002"
 EMBEDDING_DIMENSION = 1536  # OpenAI ada-002 embedding dimension
+EMBEDDING_CACHE_PATH = DATA_DIR / "embeddings.db"
+EMBEDDING_BATCH_SIZE = 512  # Texts per embeddings API request
+EMBEDDING_CONCURRENCY = 8  # Embeddings API requests in flight during ingestion
+VECTOR_INDEX_REFRESH_THRESHOLD = 1000  # Unindexed rows before the ANN index is rebuilt
 
-# Store last checked timestamps
-LAST_CHECKED_FILE = DATA_DIR / "last_checked.json"
+# Data Files
+LAST_CHECKED_FILE = DATA_DIR / "last_checked.json"  # Last checked Twitter timestamps
+TRENDS_FILE = DATA_DIR / "twitter_trends.json"
+CHAT_CONTEXT_FILE = DATA_DIR / "chat_contexts.json"
+IDEAS_FILE = DATA_DIR / "content_ideas.parquet"
+USED_IDEAS_FILE = DATA_DIR / "used_idea_ids.txt"
+LEGACY_IDEAS_FILE = DATA_DIR / "content_ideas.xlsx"  # Pre-Parquet ideas, imported once
 
 # Telegram Configuration
 MAX_RESPONSE_LENGTH = 4096  # Telegram message length limit
 RESPONSE_TEMPERATURE = 0.7
+STREAM_RESPONSES = False  # Stream single-pass answers; skips the confidence check and research crew fallback
+STREAM_EDIT_INTERVAL = 1.0  # Seconds between edits of a streaming reply
+FAST_PATH_CONFIDENCE_THRESHOLD = 0.6  # Below this, fall back to the research crew
+RAG_POOL_WORKERS = 64  # Threads for concurrent research crew runs
+
+# Answer Cache
+QA_CACHE_SIMILARITY_THRESHOLD = 0.95  # Minimum cosine similarity to reuse an answer
+QA_CACHE_TTL_DAYS = 7  # Cached answers expire after 7 days
+QA_CACHE_SWEEP_INTERVAL = 3600  # Seconds between deletions of expired answers
+QA_CACHE_MAX_ENTRIES = 10000  # Oldest answers beyond this are deleted on each sweep
 
 # Chat Context
 CHAT_CONTEXT_EXPIRY_HOURS = 24  # Chat context expires after 24 hours
 MAX_CHAT_HISTORY = 10  # Maximum number of messages to keep in chat history
-IMMEDIATE_CONTEXT_SIZE = 3  # Number of recent messages to use for immediate context 
\ No newline at end of file
+IMMEDIATE_CONTEXT_SIZE = 3  # Number of recent messages to use for immediate context
+CHAT_CONTEXT_FLUSH_INTERVAL = 30  # Seconds between chat context saves and expiry sweeps 
\ No newline at end of file
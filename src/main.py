@@ -4,12 +4,12 @@ Main script for the Move Cult AI Framework.
 
 import os
 import asyncio
+import time
+from contextlib import aclosing
 from dotenv import load_dotenv
-from pathlib import Path
 from telegram.ext import Application, MessageHandler, filters, CommandHandler, ContextTypes
 from telegram import Update
-import tweepy
-import json
+import orjson
 from datetime import datetime
 import lancedb
 
@@ -27,25 +27,42 @@ from config.settings import (
     MOVEMENT_TWITTER_ID,
     BOT_TWITTER_ID,
     LAST_CHECKED_FILE,
+    TRENDS_FILE,
     TREND_FETCH_INTERVAL,
     INTERACTION_CHECK_INTERVAL,
-    TWEET_POST_INTERVAL
+    TWEET_POST_INTERVAL,
+    MAX_RESPONSE_LENGTH,
+    STREAM_RESPONSES,
+    STREAM_EDIT_INTERVAL
 )
 
 from agents.idea_generator import IdeaGeneratorAgent
 from agents.telegram_agent import TelegramAgent
-from utils.doc_processor import DocProcessor
-
-# Initialize agents
-idea_generator = IdeaGeneratorAgent()
-telegram_agent = TelegramAgent()
 
 # Check if running in test mode
 TEST_MODE = os.getenv('TEST_MODE', 'false').lower() == 'true'
 
-# Initialize Twitter client in production mode
-if not TEST_MODE:
-    twitter_client = tweepy.Client(
+# Agents and the Twitter client are created in main()
+idea_generator = None
+telegram_agent = None
+twitter_client = None
+
+# In-memory copies of the Twitter state files, loaded once
+last_checked = None
+last_trends_tweets = None
+
+def write_file_atomic(path, data: bytes):
+    """Write a file through a temporary file so readers never see a partial write."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def create_twitter_client():
+    """Create the Twitter client used in production mode."""
+    import tweepy
+    
+    return tweepy.Client(
         bearer_token=TWITTER_BEARER_TOKEN,
         consumer_key=TWITTER_API_KEY,
         consumer_secret=TWITTER_API_SECRET,
@@ -53,13 +70,6 @@ if not TEST_MODE:
         access_token_secret=TWITTER_ACCESS_TOKEN_SECRET,
         wait_on_rate_limit=True
     )
-    print("Running in production mode - Twitter automation enabled")
-else:
-    print("Running in test mode - Twitter posting disabled")
-
-# Create data directory for storing trends
-TRENDS_FILE = "data/twitter_trends.json"
-Path("data").mkdir(exist_ok=True)
 
 async def init_vector_db():
     """Initialize vector database with documentation."""
@@ -67,34 +77,92 @@ async def init_vector_db():
     try:
         # Try to open the documents table
         table = db.open_table("documents")
+        # Searches read the file column, so rebuild tables indexed before it existed
+        if "file" not in table.schema.names:
+            print("Vector database predates the file column, rebuilding it.")
+            db.drop_table("documents")
+            raise ValueError("documents table has no file column")
         print("Vector database already initialized.")
     except Exception:
         print("Initializing vector database...")
         
+        from utils.doc_processor import DocProcessor
+        
+        async def process_repo(processor: DocProcessor) -> list:
+            """Fetch a repository's documentation and save it locally."""
+            docs = await processor.fetch_docs()
+            await asyncio.to_thread(processor.save_docs_locally, docs)
+            return docs
+            
+        # Process all repositories concurrently
+        processors = [DocProcessor(repo_url) for repo_url in GITHUB_REPOS]
+        results = await asyncio.gather(
+            *[process_repo(processor) for processor in processors],
+            return_exceptions=True
+        )
+        
+        # Collect all documents
         all_documents = []
-        # Process each repository
-        for repo_url in GITHUB_REPOS:
-            processor = DocProcessor(repo_url)
-            try:
-                # Fetch and process documentation
-                docs = processor.fetch_docs()
-                
-                # Save locally
-                processor.save_docs_locally(docs)
-                
-                # Collect all documents
-                all_documents.extend(docs)
-                
-            except Exception as e:
-                print(f"Error processing {repo_url}: {e}")
+        for processor, result in zip(processors, results):
+            if isinstance(result, Exception):
+                print(f"Error processing {processor.repo_url}: {result}")
+            else:
+                all_documents.extend(result)
                 
         # Index all documents in vector database
         if all_documents:
-            processor.index_documents(all_documents, str(VECTOR_DB_PATH))
+            await asyncio.to_thread(processors[0].index_documents, all_documents, str(VECTOR_DB_PATH))
             print(f"Indexed {len(all_documents)} documents in vector database")
         
         print("Vector database initialization complete.")
 
+def _chunks(s: str, n: int = MAX_RESPONSE_LENGTH):
+    """Split a message into parts of at most n characters, breaking on whitespace."""
+    while len(s) > n:
+        # Prefer a line break in the back half, then a space, and only cut mid-word as a last resort
+        cut = s.rfind('\n', 0, n)
+        if cut <= n // 2:
+            cut = s.rfind(' ', 0, n)
+        if cut <= 0:
+            yield s[:n]
+            s = s[n:]
+            continue
+        yield s[:cut]
+        # Drop only the separator so the next line keeps its indentation
+        s = s[cut + 1:]
+    if s:
+        yield s
+
+async def reply_streamed(update: Update, stream):
+    """Reply with a message that is edited as the response text streams in."""
+    reply = await update.message.reply_text("…")
+    response = ""
+    shown = ""
+    last_edit = time.monotonic()
+    
+    # Close the stream on errors so it releases the user's lock right away
+    async with aclosing(stream):
+        async for text in stream:
+            response += text
+            # Telegram allows roughly one edit per second per message
+            if time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL:
+                preview = response[:MAX_RESPONSE_LENGTH]
+                # Telegram ignores surrounding whitespace when checking for a changed message
+                if preview.strip() and preview.strip() != shown.strip():
+                    await reply.edit_text(preview)
+                    shown = preview
+                last_edit = time.monotonic()
+            
+    if not response.strip():
+        raise ValueError("Empty response")
+        
+    # Finish the streamed message and send any overflow as new messages
+    parts = list(_chunks(response))
+    if parts[0].strip() != shown.strip():
+        await reply.edit_text(parts[0])
+    for part in parts[1:]:
+        await update.message.reply_text(part)
+
 async def handle_telegram_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle incoming Telegram messages."""
     # Only handle DM messages
@@ -110,15 +178,18 @@ async def handle_telegram_message(update: Update, context: ContextTypes.DEFAULT_
     message = update.message.text
     
     try:
+        if STREAM_RESPONSES:
+            await reply_streamed(update, telegram_agent.stream_message(message, user_id))
+            return
+            
         response = await telegram_agent.process_message(message, user_id)
         
-        # Split long responses if needed
-        if len(response) > 4096:  # Telegram message length limit
-            parts = [response[i:i+4096] for i in range(0, len(response), 4096)]
-            for part in parts:
-                await update.message.reply_text(part)
-        else:
-            await update.message.reply_text(response)
+        if not response.strip():
+            raise ValueError("Empty response")
+            
+        # Split long responses at Telegram's message length limit
+        for part in _chunks(response):
+            await update.message.reply_text(part)
     except Exception as e:
         error_message = "I apologize, but I encountered an error processing your request. Please try again."
         await update.message.reply_text(error_message)
@@ -169,6 +240,8 @@ Feel free to ask any questions! I'll remember our conversation context to provid
 
 async def fetch_and_store_trends():
     """Fetch and store Twitter trends."""
+    global last_trends_tweets
+    
     if TEST_MODE:
         return
         
@@ -179,19 +252,28 @@ async def fetch_and_store_trends():
             max_results=100
         )
         
+        if not tweets.data:
+            print("No new trends found")
+            return
+            
         # Process trends
         idea_generator.process_trends(tweets.data)
         
+        # Skip the write when the same tweets were stored last time
+        tweets_json = orjson.dumps([tweet.data for tweet in tweets.data])
+        if tweets_json == last_trends_tweets:
+            print("Trends unchanged since last fetch")
+            return
+            
         # Store trends data
         trends_data = {
             'timestamp': datetime.now().isoformat(),
-            'tweets': [tweet.data for tweet in tweets.data] if tweets.data else []
+            'tweets': orjson.Fragment(tweets_json)
         }
-        
-        with open(TRENDS_FILE, 'w') as f:
-            json.dump(trends_data, f)
+        write_file_atomic(TRENDS_FILE, orjson.dumps(trends_data))
+        last_trends_tweets = tweets_json
             
-        print(f"Stored {len(trends_data['tweets'])} trends")
+        print(f"Stored {len(tweets.data)} trends")
         
     except Exception as e:
         print(f"Error fetching trends: {e}")
@@ -224,15 +306,20 @@ async def check_and_retweet_movement():
 
 async def handle_interactions():
     """Handle all Twitter interactions (mentions, replies, etc.)."""
+    global last_checked
+    
     if TEST_MODE:
         return
         
     try:
-        # Load last checked timestamp
-        last_checked = {}
-        if os.path.exists(LAST_CHECKED_FILE):
-            with open(LAST_CHECKED_FILE, 'r') as f:
-                last_checked = json.load(f)
+        # Load last checked timestamps on first use
+        if last_checked is None:
+            # Only cache the timestamps once they load, so a failed read is retried next cycle
+            loaded = {}
+            if os.path.exists(LAST_CHECKED_FILE):
+                with open(LAST_CHECKED_FILE, 'rb') as f:
+                    loaded = orjson.loads(f.read())
+            last_checked = loaded
         
         current_time = datetime.now().isoformat()
         
@@ -288,8 +375,7 @@ async def handle_interactions():
             'replies': current_time
         })
         
-        with open(LAST_CHECKED_FILE, 'w') as f:
-            json.dump(last_checked, f)
+        write_file_atomic(LAST_CHECKED_FILE, orjson.dumps(last_checked))
             
     except Exception as e:
         print(f"Error handling interactions: {e}")
@@ -310,47 +396,49 @@ async def generate_and_post_tweet():
     except Exception as e:
         print(f"Error posting tweet: {e}")
 
+async def run_periodically(job, interval: int):
+    """Run a job every interval seconds, keeping failures to a single cycle."""
+    while True:
+        try:
+            await job()
+        except Exception as e:
+            print(f"Error in Twitter automation: {e}")
+        await asyncio.sleep(interval)
+
 async def run_twitter_automation():
     """Run Twitter automation tasks."""
     if TEST_MODE:
         return
         
-    while True:
-        try:
-            # Schedule tasks at different intervals
-            await asyncio.gather(
-                # Fetch trends every 12 hours
-                asyncio.create_task(
-                    asyncio.gather(
-                        fetch_and_store_trends(),
-                        asyncio.sleep(TREND_FETCH_INTERVAL)
-                    )
-                ),
-                # Check and handle all interactions every 4 hours
-                asyncio.create_task(
-                    asyncio.gather(
-                        handle_interactions(),
-                        check_and_retweet_movement(),
-                        asyncio.sleep(INTERACTION_CHECK_INTERVAL)
-                    )
-                ),
-                # Post tweet every 24 hours
-                asyncio.create_task(
-                    asyncio.gather(
-                        generate_and_post_tweet(),
-                        asyncio.sleep(TWEET_POST_INTERVAL)
-                    )
-                )
-            )
-        except Exception as e:
-            print(f"Error in Twitter automation: {e}")
-            await asyncio.sleep(60)  # Wait a minute before retrying
+    # Each task runs on its own schedule and never cancels the others
+    await asyncio.gather(
+        # Fetch trends every 12 hours
+        run_periodically(fetch_and_store_trends, TREND_FETCH_INTERVAL),
+        # Check and handle all interactions every 4 hours
+        run_periodically(handle_interactions, INTERACTION_CHECK_INTERVAL),
+        run_periodically(check_and_retweet_movement, INTERACTION_CHECK_INTERVAL),
+        # Post tweet every 24 hours
+        run_periodically(generate_and_post_tweet, TWEET_POST_INTERVAL)
+    )
 
 async def main():
     """Main function to run the framework."""
+    global idea_generator, telegram_agent, twitter_client
+    
     # Load environment variables
     load_dotenv()
     
+    # Initialize agents
+    idea_generator = IdeaGeneratorAgent()
+    telegram_agent = TelegramAgent()
+    
+    # Initialize Twitter client in production mode
+    if not TEST_MODE:
+        twitter_client = create_twitter_client()
+        print("Running in production mode - Twitter automation enabled")
+    else:
+        print("Running in test mode - Twitter posting disabled")
+    
     # Initialize vector database if needed
     await init_vector_db()
     
@@ -390,6 +478,7 @@ async def main():
         print("\nReceived stop signal")
     finally:
         print("Stopping bot...")
+        await telegram_agent.flush_chat_contexts()
         if application.updater.running:
             await application.updater.stop()
         await application.stop()
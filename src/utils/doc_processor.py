@@ -2,99 +2,165 @@
 Document processor for fetching and processing Movement Labs documentation.
 """
 
-import os
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Tuple
 from langchain.text_splitter import MarkdownTextSplitter
-from langchain.embeddings import OpenAIEmbeddings
-import tempfile
-import shutil
 import lancedb
-import json
-import subprocess
+import orjson
+import tarfile
+import math
+import asyncio
+from urllib.parse import quote
+import numpy as np
+import pyarrow as pa
+import httpx
+import requests
+
+from utils.embedding_cache import get_cached_embedder
+from config.settings import (
+    CHUNK_SIZE,
+    CHUNK_OVERLAP,
+    DOCS_DIR,
+    EMBEDDING_DIMENSION,
+    GITHUB_TOKEN,
+    VECTOR_INDEX_REFRESH_THRESHOLD
+)
+
+GITHUB_MAX_CONNECTIONS = 32  # Concurrent raw file downloads per repository
+GITHUB_FETCH_ATTEMPTS = 3  # Tries per raw file download before giving up on the API path
+DOC_SUFFIXES = ('.md',)  # Documentation file extensions, checked in one endswith call
+SKIPPED_DIRS = frozenset({'.git', '.github', 'node_modules', 'vendor'})  # Never fetch files under these
+
+# Vectors are stored as float16, halving the bytes scanned per search
+DOCUMENTS_SCHEMA = pa.schema([
+    pa.field("text", pa.string()),
+    pa.field("file", pa.string()),
+    pa.field("metadata", pa.string()),
+    pa.field("vector", pa.list_(pa.float16(), EMBEDDING_DIMENSION))
+])
 
 class DocProcessor:
-    def __init__(self, repo_url: str, branch: str = "main"):
+    # The splitter configuration is the same for every repository, so build it once
+    _SPLITTER = MarkdownTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP
+    )
+    
+    def __init__(self, repo_url: str, branch: str = "HEAD"):
         self.repo_url = repo_url
+        # HEAD resolves to the repository's default branch in the tree, raw and tarball URLs
         self.branch = branch
-        self.embeddings = OpenAIEmbeddings()
-        self.text_splitter = MarkdownTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=100
+        self.embeddings = get_cached_embedder()
+        self.text_splitter = DocProcessor._SPLITTER
+        
+        # Derive repository names and URLs once instead of per chunk
+        owner, self._repo_name = repo_url.rstrip('/').rsplit('/', 2)[-2:]
+        self.api_url = f"https://api.github.com/repos/{owner}/{self._repo_name}"
+        self.raw_url = f"https://raw.githubusercontent.com/{owner}/{self._repo_name}/{branch}"
+        self._metadata_template = {'source': repo_url, 'repo': self._repo_name}
+        
+    def _headers(self) -> Dict[str, str]:
+        """Get the HTTP headers for GitHub requests."""
+        return {'Authorization': f"token {GITHUB_TOKEN}"} if GITHUB_TOKEN else {}
+        
+    @staticmethod
+    def _is_doc_file(path: str) -> bool:
+        """Check whether a repository path is a documentation file outside skipped directories."""
+        return path.endswith(DOC_SUFFIXES) and SKIPPED_DIRS.isdisjoint(path.split('/'))
+        
+    async def _list_tree(self, client: httpx.AsyncClient) -> List[str]:
+        """List documentation file paths with a single tree API call."""
+        response = await client.get(
+            f"{self.api_url}/git/trees/{self.branch}",
+            params={'recursive': '1'}
         )
+        response.raise_for_status()
+        tree = response.json()
+        if tree.get('truncated'):
+            raise ValueError("repository tree listing is truncated")
+        return [
+            entry['path'] for entry in tree['tree']
+            if entry['type'] == 'blob' and self._is_doc_file(entry['path'])
+        ]
         
-    def _clone_repo(self) -> str:
-        """Clone repository to temporary directory."""
-        temp_dir = tempfile.mkdtemp()
-        try:
-            # Use git clone command through subprocess
-            result = subprocess.run(
-                ["git", "clone", "--depth", "1", self.repo_url, temp_dir],
-                capture_output=True,
-                text=True
+    async def _fetch_file(self, client: httpx.AsyncClient, path: str) -> str:
+        """Download a file from raw.githubusercontent.com, retrying transient failures."""
+        for attempt in range(GITHUB_FETCH_ATTEMPTS):
+            try:
+                response = await client.get(f"{self.raw_url}/{quote(path)}")
+                response.raise_for_status()
+                return response.text
+            except httpx.HTTPError as e:
+                if attempt == GITHUB_FETCH_ATTEMPTS - 1:
+                    raise
+                print(f"Error fetching {path}, retrying: {e}")
+                await asyncio.sleep(2 ** attempt)
+                
+    async def _fetch_via_api(self) -> List[Dict]:
+        """Fetch and process documentation files without cloning the repository."""
+        # One HTTP/2 client so every request reuses the same TLS connections
+        async with httpx.AsyncClient(
+            http2=True,
+            headers=self._headers(),
+            timeout=httpx.Timeout(30, pool=None),  # Queued downloads wait for a free connection
+            limits=httpx.Limits(max_connections=GITHUB_MAX_CONNECTIONS)
+        ) as client:
+            paths = await self._list_tree(client)
+            contents = await asyncio.gather(
+                *[self._fetch_file(client, path) for path in paths],
+                return_exceptions=True
             )
-            if result.returncode == 0:
-                return temp_dir
-            else:
-                print(f"Error cloning repository {self.repo_url}: {result.stderr}")
-                if os.path.exists(temp_dir):
-                    shutil.rmtree(temp_dir)
-                return None
-        except Exception as e:
-            print(f"Error cloning repository {self.repo_url}: {e}")
-            if os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
-            return None
-        
-    def _process_markdown_files(self, repo_dir: str) -> List[Dict]:
-        """Process markdown files in repository."""
-        documents = []
+            
+        # The table is only built once, so never index a partial download
+        failed = [path for path, content in zip(paths, contents) if isinstance(content, Exception)]
+        if failed:
+            raise RuntimeError(f"failed to download {len(failed)} of {len(paths)} files")
+            
+        return self._chunk_files(list(zip(paths, contents)))
         
-        if not repo_dir:
-            return documents
+    def _chunk_files(self, files: List[Tuple[str, str]]) -> List[Dict]:
+        """Split (relative path, content) markdown files into chunks with metadata."""
+        if not files:
+            return []
             
-        for root, _, files in os.walk(repo_dir):
-            for file in files:
-                if file.endswith('.md'):
-                    file_path = os.path.join(root, file)
-                    try:
-                        # Read markdown file directly
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            content = f.read()
-                            
-                        # Split into chunks
-                        chunks = self.text_splitter.split_text(content)
-                        
-                        # Add metadata
-                        for chunk in chunks:
-                            relative_path = os.path.relpath(file_path, repo_dir)
-                            metadata = {
-                                'source': self.repo_url,
-                                'file': relative_path,
-                                'repo': self.repo_url.split('/')[-1]
-                            }
-                            documents.append({
-                                'text': chunk,
-                                'metadata': metadata
-                            })
-                            
-                    except Exception as e:
-                        print(f"Error processing {file_path}: {e}")
-                        
-        return documents
+        # Split all files in one splitter call, attaching metadata per file
+        paths, contents = zip(*files)
+        chunks = self.text_splitter.create_documents(
+            list(contents),
+            metadatas=[{**self._metadata_template, 'file': path} for path in paths]
+        )
+        return [{'text': chunk.page_content, 'metadata': chunk.metadata} for chunk in chunks]
+        
+    def _fetch_via_archive(self) -> List[Dict]:
+        """Fetch and process documentation files by streaming the repository tarball."""
+        files = []
+        with requests.Session() as session:
+            session.headers.update(self._headers())
+            with session.get(f"{self.api_url}/tarball/{self.branch}", stream=True, timeout=60) as response:
+                response.raise_for_status()
+                with tarfile.open(fileobj=response.raw, mode='r|gz') as archive:
+                    for member in archive:
+                        if not member.isfile() or not self._is_doc_file(member.name):
+                            continue
+                        # Member names are prefixed with a "<owner>-<repo>-<sha>/" directory
+                        relative_path = member.name.split('/', 1)[-1]
+                        try:
+                            files.append((relative_path, archive.extractfile(member).read().decode('utf-8')))
+                        except Exception as e:
+                            print(f"Error processing {relative_path}: {e}")
+        return self._chunk_files(files)
         
-    def fetch_docs(self) -> List[Dict]:
+    async def fetch_docs(self) -> List[Dict]:
         """Fetch and process documentation from repository."""
-        temp_dir = None
         try:
-            # Clone repository
-            temp_dir = self._clone_repo()
-            if not temp_dir:
-                return []
+            try:
+                # List the tree once and download only documentation files
+                documents = await self._fetch_via_api()
+            except Exception as e:
+                print(f"GitHub API fetch failed for {self.repo_url}, downloading archive instead: {e}")
+                # tarfile reads the stream synchronously, so keep it off the event loop
+                documents = await asyncio.to_thread(self._fetch_via_archive)
                 
-            # Process markdown files
-            documents = self._process_markdown_files(temp_dir)
-            
             # Ensure we have valid documents
             if not documents:
                 print(f"No valid documents found in repository: {self.repo_url}")
@@ -114,47 +180,46 @@ class DocProcessor:
             print(f"Error fetching documents from {self.repo_url}: {e}")
             return []
             
-        finally:
-            # Cleanup temporary directory
-            if temp_dir and os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
-                
-    def save_docs_locally(self, documents: List[Dict], output_dir: str = "data/docs"):
+    def save_docs_locally(self, documents: List[Dict], output_dir: str = str(DOCS_DIR)):
         """Save processed documents locally."""
         output_path = Path(output_dir)
         output_path.mkdir(parents=True, exist_ok=True)
         
-        # Group documents by repository
-        docs_by_repo = {}
-        for doc in documents:
-            repo = doc['metadata']['repo']
-            if repo not in docs_by_repo:
-                docs_by_repo[repo] = []
-            docs_by_repo[repo].append(doc)
-            
-        # Save each repository's documents
-        for repo, docs in docs_by_repo.items():
-            repo_file = output_path / f"{repo}.json"
-            with open(repo_file, 'w', encoding='utf-8') as f:
-                json.dump(docs, f, indent=2, ensure_ascii=False)
+        # Stream each document into its repository's JSON array
+        repo_files = {}
+        try:
+            for doc in documents:
+                repo = doc['metadata']['repo']
+                f = repo_files.get(repo)
+                if f is None:
+                    f = repo_files[repo] = open(output_path / f"{repo}.json", 'wb')
+                    f.write(b"[\n")
+                else:
+                    f.write(b",\n")
+                f.write(orjson.dumps(doc, option=orjson.OPT_INDENT_2))
+        finally:
+            for f in repo_files.values():
+                f.write(b"\n]\n")
+                f.close()
                 
     def index_documents(self, documents: List[Dict], vector_db_path: str):
         """Index documents in vector database."""
         # Create or get table
         db = lancedb.connect(vector_db_path)
         
-        # Prepare data for indexing
-        data = []
-        for doc in documents:
-            # Get embedding for the document
-            embedding = self.embeddings.embed_query(doc['text'])
-            
-            # Add to data list
-            data.append({
-                "text": doc['text'],
-                "metadata": json.dumps(doc['metadata']),  # Convert metadata to string
-                "vector": embedding
-            })
+        # Get embeddings for all documents in batched requests
+        embeddings = self.embeddings.embed_documents([doc['text'] for doc in documents])
+        
+        # Prepare columnar data for indexing
+        vectors = np.asarray(embeddings, dtype=np.float16).reshape(-1)
+        data = pa.Table.from_arrays([
+            pa.array([doc['text'] for doc in documents], pa.string()),
+            # Own column so searches can skip metadata parsing
+            pa.array([doc['metadata']['file'] for doc in documents], pa.string()),
+            # Convert metadata to string
+            pa.array([orjson.dumps(doc['metadata']).decode() for doc in documents], pa.string()),
+            pa.FixedSizeListArray.from_arrays(pa.array(vectors), EMBEDDING_DIMENSION)
+        ], schema=DOCUMENTS_SCHEMA)
             
         try:
             # Try to open existing table
@@ -166,7 +231,32 @@ class DocProcessor:
             table = db.create_table(
                 "documents",
                 data=data,
+                schema=DOCUMENTS_SCHEMA,
                 mode="overwrite"
             )
             
-        print(f"Indexed {len(data)} documents in vector database") 
\ No newline at end of file
+        self._refresh_vector_index(table)
+        
+        print(f"Indexed {len(data)} documents in vector database")
+        
+    def _refresh_vector_index(self, table):
+        """Rebuild the ANN index once enough rows are not covered by it."""
+        indices = table.list_indices()
+        if indices:
+            unindexed = table.index_stats(indices[0].name).num_unindexed_rows
+        else:
+            unindexed = table.count_rows()
+            
+        if unindexed < VECTOR_INDEX_REFRESH_THRESHOLD:
+            return
+            
+        # HNSW graphs over int8 scalar-quantized vectors inside each IVF partition.
+        # The default L2 metric ranks ada-002's unit-length vectors the same as cosine.
+        row_count = table.count_rows()
+        table.create_index(
+            vector_column_name="vector",
+            index_type="IVF_HNSW_SQ",
+            num_partitions=max(1, int(math.sqrt(row_count))),
+            replace=True
+        )
+        print(f"Built vector index over {row_count} documents") 
\ No newline at end of file
@@ -0,0 +1,172 @@
+"""
+Embedding cache for OpenAI embeddings, backed by an in-memory LRU and SQLite.
+"""
+
+import asyncio
+import hashlib
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+from config.settings import (
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CONCURRENCY,
+    EMBEDDING_MODEL
+)
+
+SQLITE_MAX_PARAMS = 900  # Stay below SQLite's default bound-parameter limit
+MEMORY_CACHE_SIZE = 2048  # Most recent query vectors kept in memory
+
+def _normalize(text: str) -> str:
+    """Normalize a query so trivial variations share one cache entry."""
+    return re.sub(r'\s+', ' ', text.strip().lower()).rstrip('?!.')
+
+class CachedEmbedder:
+    def __init__(self, embeddings, db_path: str = str(EMBEDDING_CACHE_PATH)):
+        self.embeddings = embeddings
+        self._lock = threading.Lock()
+        # Separate lock so in-memory hits never wait on SQLite I/O
+        self._memory_lock = threading.Lock()
+        self._memory = OrderedDict()
+        # Embedding calls run from executor threads as well as the event loop
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        # WAL keeps cache writes cheap and lets reads proceed during them
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (hash TEXT PRIMARY KEY, vector BLOB)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _key(text: str) -> str:
+        """Get the cache key for a text."""
+        return hashlib.sha256((EMBEDDING_MODEL + text).encode()).hexdigest()
+
+    def _load(self, key: str):
+        """Load a vector from the on-disk cache."""
+        return self._load_many([key]).get(key)
+
+    def _load_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Load the cached vectors for a list of keys."""
+        found = {}
+        for i in range(0, len(keys), SQLITE_MAX_PARAMS):
+            batch = keys[i:i + SQLITE_MAX_PARAMS]
+            placeholders = ",".join("?" * len(batch))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE hash IN ({placeholders})",
+                    batch
+                ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def _store(self, key: str, vector: List[float]):
+        """Store a vector in the on-disk cache."""
+        self._store_many([(key, vector)])
+
+    def _store_many(self, items: List[Tuple[str, List[float]]]):
+        """Store a list of (key, vector) pairs in the on-disk cache."""
+        rows = [
+            (key, np.asarray(vector, dtype=np.float32).tobytes())
+            for key, vector in items
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (hash, vector) VALUES (?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def _recall(self, text: str) -> Optional[Tuple[float, ...]]:
+        """Get a vector from the in-memory LRU cache."""
+        with self._memory_lock:
+            vector = self._memory.get(text)
+            if vector is not None:
+                self._memory.move_to_end(text)
+            return vector
+
+    def _remember(self, text: str, vector: List[float]):
+        """Add a vector to the in-memory LRU cache, evicting the least recently used."""
+        with self._memory_lock:
+            self._memory[text] = tuple(vector)
+            self._memory.move_to_end(text)
+            if len(self._memory) > MEMORY_CACHE_SIZE:
+                self._memory.popitem(last=False)
+
+    def _embed(self, text: str) -> List[float]:
+        """Embed a single text, checking the on-disk cache first."""
+        key = self._key(text)
+        vector = self._load(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self._store(key, vector)
+        return vector
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query text."""
+        text = _normalize(text)
+        vector = self._recall(text)
+        if vector is None:
+            vector = self._embed(text)
+            self._remember(text, vector)
+        return list(vector)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Embed a query text without blocking the event loop on SQLite or the API call."""
+        text = _normalize(text)
+        vector = self._recall(text)
+        if vector is None:
+            key = self._key(text)
+            vector = await asyncio.to_thread(self._load, key)
+            if vector is None:
+                vector = await self.embeddings.aembed_query(text)
+                await asyncio.to_thread(self._store, key, vector)
+            self._remember(text, vector)
+        return list(vector)
+
+    def embed_documents(self, texts: List[str], batch_size: int = EMBEDDING_BATCH_SIZE) -> List[List[float]]:
+        """Embed a list of document texts, batching the uncached ones."""
+        keys = [self._key(text) for text in texts]
+        vectors = self._load_many(list(set(keys)))
+
+        # Embed each missing text once, batch_size texts per API call
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        for batch in self._get_embeddings_batch(list(missing.items()), batch_size):
+            self._store_many(batch)
+            vectors.update(batch)
+
+        return [vectors[key] for key in keys]
+
+    def _get_embeddings_batch(self, items: List[Tuple[str, str]], batch_size: int):
+        """Yield (key, vector) pairs for (key, text) items, one API call per batch."""
+        batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+        if not batches:
+            return
+        # The endpoint is latency-bound, so keep several batch requests in flight
+        with ThreadPoolExecutor(max_workers=min(EMBEDDING_CONCURRENCY, len(batches))) as pool:
+            results = pool.map(
+                lambda batch: self.embeddings.embed_documents([text for _, text in batch]),
+                batches
+            )
+            for batch, embedded in zip(batches, results):
+                yield [(key, vector) for (key, _), vector in zip(batch, embedded)]
+
+_shared_embedder = None
+
+def get_cached_embedder() -> CachedEmbedder:
+    """Get the process-wide cached embedder."""
+    global _shared_embedder
+    if _shared_embedder is None:
+        from langchain.embeddings import OpenAIEmbeddings
+        _shared_embedder = CachedEmbedder(OpenAIEmbeddings(model=EMBEDDING_MODEL))
+    return _shared_embedder